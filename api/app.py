@@ -1,131 +1,473 @@
 # api/app.py (增强版)
 
 import os
-import json
+import atexit
+import base64
+import binascii
+import hashlib
+import logging
+import queue
+import re
+import sys
+import orjson
+import msgpack
+import time
+import threading
 import requests
-from flask import Flask, request, jsonify
-import google.generativeai as genai
-from vercel_kv import KV
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, request, jsonify
 
 # --- 配置区: 从 Vercel 的环境变量中读取密钥 ---
 FEISHU_APP_ID = os.environ.get("FEISHU_APP_ID")
 FEISHU_APP_SECRET = os.environ.get("FEISHU_APP_SECRET")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 
+# 每个会话最多保留的对话轮数 (一轮 = 用户 + 模型两条消息)
+MAX_HISTORY_TURNS = 12
+
+# 日志：请求线程只把日志放进队列，由后台线程统一写到 stdout，不会阻塞在日志 I/O 上
+# 日常的成功日志是 debug 级别，生产环境可以通过 LOG_LEVEL 环境变量过滤掉
+_log_formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(_log_formatter)
+_log_queue = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_queue_handler = QueueHandler(_log_queue)
+# 入队前只保留消息本身，真正的格式化交给后台线程里的 _log_handler
+_queue_handler.setFormatter(logging.Formatter("%(message)s"))
+_queue_handler.addFilter(lambda record: record.levelno < logging.ERROR)
+# ERROR 及以上直接同步写到 stderr：Vercel 冻结或回收实例时队列里还没写出的日志会丢，错误日志不能冒这个险
+_error_handler = logging.StreamHandler(sys.stderr)
+_error_handler.setFormatter(_log_formatter)
+_error_handler.setLevel(logging.ERROR)
+
+# LOG_LEVEL 不区分大小写，写错了就退回 INFO，不能因为一个环境变量让整个函数导入失败
+_log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO").strip().upper())
+if not isinstance(_log_level, int):
+    _log_level = logging.INFO
+logging.basicConfig(level=_log_level, handlers=[_queue_handler, _error_handler])
+logger = logging.getLogger(__name__)
+
 # 初始化服务
 app = Flask(__name__)
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-    kv = KV()
-    print("Gemini and Vercel KV initialized successfully.")
-except Exception as e:
-    print(f"Error initializing services: {e}")
-
-# ... (get_feishu_tenant_token 和 reply_to_feishu 函数保持不变)
-def get_feishu_tenant_token():
-    token = kv.get('FEISHU_TENANT_ACCESS_TOKEN')
-    if token: return token
+
+# Gemini SDK (protobuf、grpcio 等) 和 KV 客户端都推迟到第一次用到时再导入、初始化，
+# 冷启动时像 URL 校验这种请求完全不用付这部分的导入开销
+gemini_model = None
+kv = None
+# 两个客户端各用一把锁：冷启动时主线程在导入 Gemini SDK，预取 token 的线程初始化 KV 不用跟着等
+_gemini_init_lock = threading.Lock()
+_kv_init_lock = threading.Lock()
+
+def _gemini():
+    global gemini_model
+    if gemini_model is None:
+        with _gemini_init_lock:
+            if gemini_model is None:
+                try:
+                    import google.generativeai as genai
+                    # 固定使用 gRPC：所有请求复用同一个 HTTP/2 连接多路复用 (SDK 按进程缓存 client)
+                    genai.configure(api_key=GEMINI_API_KEY, transport="grpc")
+                    gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
+                    logger.debug("Gemini initialized successfully.")
+                except Exception as e:
+                    logger.error("Error initializing Gemini: %s", e)
+                    raise
+    return gemini_model
+
+def _kv():
+    global kv
+    if kv is None:
+        with _kv_init_lock:
+            if kv is None:
+                try:
+                    from vercel_kv import KV
+                    kv = KV()
+                    logger.debug("Vercel KV initialized successfully.")
+                except Exception as e:
+                    logger.error("Error initializing Vercel KV: %s", e)
+                    raise
+    return kv
+
+# 复用同一个 Session 调用飞书接口：keep-alive + 连接池，省掉每次请求的 TCP/TLS 握手
+# (Vercel 的热容器会复用进程，连接池可以跨多次 webhook 调用保留)
+_feishu_session = requests.Session()
+_feishu_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=20))
+_feishu_session.headers.update({"Content-Type": "application/json; charset=utf-8"})
+
+# 进程内 token 缓存，命中时连 KV 都不用访问
+# KV 里的 token 比飞书给的有效期提前 600 秒过期，所以从 KV 读到的 token 至少还剩 600 秒，
+# 本地只缓存 300 秒；自己从飞书拿到的新 token 本地缓存到过期前 1200 秒。
+# 剩余不到 1500 秒 (soft_exp 之后) 时继续用旧 token，同时在后台刷新：飞书只有在剩余有效期
+# 不足 30 分钟时才会换发新 token，刷新点必须晚于 30 分钟这个界限，否则拿回来的还是同一个 token
+_TOKEN_CACHE = {"token": None, "exp": 0.0, "soft_exp": 0.0}
+_token_refresh_lock = threading.Lock()
+
+def _fetch_feishu_tenant_token():
     url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
     payload = {"app_id": FEISHU_APP_ID, "app_secret": FEISHU_APP_SECRET}
     try:
-        response = requests.post(url, headers={"Content-Type": "application/json"}, json=payload, timeout=5)
-        data = response.json()
+        response = _feishu_session.post(url, data=orjson.dumps(payload), timeout=5)
+        data = orjson.loads(response.content)
         if data.get("code") == 0:
             token = data.get("tenant_access_token")
-            kv.set('FEISHU_TENANT_ACCESS_TOKEN', token, ex=6600)
+            expire = data.get("expire", 7200)
+            _kv().set('FEISHU_TENANT_ACCESS_TOKEN', token, ex=expire - 600)
+            now = time.time()
+            _TOKEN_CACHE.update(token=token, exp=now + expire - 1200, soft_exp=now + expire - 1500)
             return token
     except Exception as e:
-        print(f"Error getting token: {e}")
+        logger.error("Error getting token: %s", e)
     return None
 
+def _adopt_kv_token():
+    # KV 里已经有别的实例刷新好的新 token 时直接拿来用，不再请求飞书
+    token = _kv().get('FEISHU_TENANT_ACCESS_TOKEN')
+    if token and token != _TOKEN_CACHE["token"]:
+        now = time.time()
+        _TOKEN_CACHE.update(token=token, exp=now + 300, soft_exp=now + 300)
+        return True
+    return False
+
+def _refresh_feishu_token():
+    # 后台刷新：进程内已有线程在刷新就直接退出；跨实例用 KV 里的短锁 (SETNX) 协调，
+    # 只有抢到锁的实例去请求飞书，其他实例从 KV 读取它刷新后的 token
+    if not _token_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        if _adopt_kv_token():
+            return
+        if _kv().set('FEISHU_TENANT_ACCESS_TOKEN_LOCK', "1", nx=True, ex=30):
+            # 抢到锁之前可能刚有别的实例刷新完，再确认一次
+            if not _adopt_kv_token():
+                _fetch_feishu_tenant_token()
+        else:
+            # 别的实例正在刷新，30 秒后再从 KV 读它的结果
+            _TOKEN_CACHE["soft_exp"] = time.time() + 30
+    except Exception as e:
+        logger.error("Error refreshing token: %s", e)
+    finally:
+        _token_refresh_lock.release()
+
+def get_feishu_tenant_token():
+    now = time.time()
+    token = _TOKEN_CACHE["token"]
+    if token and now < _TOKEN_CACHE["exp"]:
+        if now >= _TOKEN_CACHE["soft_exp"] and not _token_refresh_lock.locked():
+            threading.Thread(target=_refresh_feishu_token, daemon=True).start()
+        return token
+
+    # 本地缓存已过期：同一进程里只让一个线程去查 KV / 请求飞书，其他线程等它的结果
+    with _token_refresh_lock:
+        now = time.time()
+        if _TOKEN_CACHE["token"] and now < _TOKEN_CACHE["exp"]:
+            return _TOKEN_CACHE["token"]
+        token = _kv().get('FEISHU_TENANT_ACCESS_TOKEN')
+        if token:
+            _TOKEN_CACHE.update(token=token, exp=now + 300, soft_exp=now + 300)
+            return token
+        return _fetch_feishu_tenant_token()
+
 def reply_to_feishu(message_id, content):
     token = get_feishu_tenant_token()
     if not token: return
     url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}/reply"
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json; charset=utf-8"}
-    payload = {"msg_type": "text", "content": json.dumps({"text": content})}
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {"msg_type": "text", "content": orjson.dumps({"text": content}).decode()}
     try:
-        requests.post(url, headers=headers, json=payload, timeout=5)
+        response = _feishu_session.post(url, headers=headers, data=orjson.dumps(payload), timeout=5)
+        data = orjson.loads(response.content)
+        if data.get("code") == 0:
+            # 返回机器人这条回复的 message_id，流式输出时用来继续编辑
+            return data.get("data", {}).get("message_id")
+        logger.error("Error replying to feishu: %s", data.get("msg"))
     except Exception as e:
-        print(f"Error replying to feishu: {e}")
+        logger.error("Error replying to feishu: %s", e)
 
+def edit_feishu_message(message_id, content):
+    token = get_feishu_tenant_token()
+    if not token: return
+    url = f"https://open.feishu.cn/open-apis/im/v1/messages/{message_id}"
+    headers = {"Authorization": f"Bearer {token}"}
+    payload = {"msg_type": "text", "content": orjson.dumps({"text": content}).decode()}
+    try:
+        _feishu_session.put(url, headers=headers, data=orjson.dumps(payload), timeout=5)
+    except Exception as e:
+        logger.error("Error editing feishu message: %s", e)
+
+
+def _compact_history(history):
+    # 把 SDK 的 Content 对象压成 {"role": ..., "parts": [text]}，只留文本，KV 里的体积小很多
+    compact = []
+    for content in history:
+        if isinstance(content, dict):
+            role, parts = content.get("role"), [part for part in content.get("parts", []) if part]
+        else:
+            role, parts = content.role, [part.text for part in content.parts if part.text]
+        if not parts:
+            # Gemini 不接受 parts 为空的 contents；没有文本的模型回复连同它对应的用户消息一起丢掉
+            if role == "model" and compact and compact[-1]["role"] == "user":
+                compact.pop()
+            continue
+        compact.append({"role": role, "parts": parts})
+    return compact
+
+def _pack_history(history):
+    # 历史记录用 msgpack 编码后再转 base64 字符串存进 KV，比默认 ASCII 转义的 JSON (每个中文字符变成 \uXXXX) 小
+    return base64.b64encode(msgpack.packb(_compact_history(history))).decode()
+
+def _unpack_history(value):
+    if isinstance(value, list):
+        # 兼容之前直接以 JSON 列表存进 KV 的历史记录
+        return value
+    try:
+        history = msgpack.unpackb(base64.b64decode(value, validate=True))
+    except (binascii.Error, ValueError, TypeError, msgpack.UnpackException) as e:
+        # 解不开的历史 (旧格式或被其他客户端写成了别的样子) 当作空历史，不能让这个会话一直出错
+        logger.error("Error decoding conversation history: %r", e)
+        return []
+    return history if isinstance(history, list) else []
 
 def get_conversation_history(session_id):
-    history = kv.get(session_id)
-    return history if history else []
+    value = _kv().get(session_id)
+    history = _unpack_history(value) if value else []
+    # 只把最近 MAX_HISTORY_TURNS 轮发给 Gemini，请求大小不随会话长度线性增长
+    return history[-MAX_HISTORY_TURNS * 2:]
 
 def save_conversation_history(session_id, history):
-    kv.set(session_id, history, ex=3600)
+    # 只保存最近 MAX_HISTORY_TURNS 轮，KV 里的值不会随会话无限变大；
+    # SET 带 ex 本身就是一条命令、一次往返，不需要再拆成 set + expire
+    _kv().set(session_id, _pack_history(history[-MAX_HISTORY_TURNS * 2:]), ex=3600)
 
 def clear_conversation_history(session_id):
-    kv.delete(session_id)
+    _kv().delete(session_id)
 
 
-@app.route('/', defaults={'path': ''}, methods=['GET', 'POST'])
-@app.route('/<path:path>', methods=['GET', 'POST'])
-def webhook_handler(path):
-    data = request.json
-
-    # --- 逻辑分流：判断是飞书聊天事件还是多维表格的直接调用 ---
-
-    # 1. 如果是飞书聊天事件 (包含 header 和 event 结构)
-    if data and data.get("header", {}).get("event_type") == "im.message.receive_v1":
-        # (这部分是原来的聊天机器人逻辑，保持不变)
-        if "challenge" in data:
-            return jsonify({"challenge": data["challenge"]})
-        
-        event = data.get("event", {})
-        message = event.get("message", {})
-        sender = event.get("sender", {})
-        message_id = message.get("message_id")
-        session_id = f"feishu_session_{message.get('chat_id')}_{sender.get('sender_id', {}).get('user_id')}"
-        
-        try:
-            content_json = json.loads(message.get("content", "{}"))
-            user_text = content_json.get("text", "").strip().replace("@_user_1", "").strip()
-        except (json.JSONDecodeError, AttributeError):
-            user_text = ""
+# 线程池只用来在请求处理期间并行做一些辅助 I/O (比如预取 token)。
+# Vercel 在返回响应后可能直接冻结实例，所以回复用户的主流程必须在请求内完成，不能丢到这里
+_executor = ThreadPoolExecutor(max_workers=8)
+
+# 飞书单条消息最多只能编辑 20 次，流式输出时按时间间隔合并，编辑次数留一点余量
+STREAM_EDIT_INTERVAL = 1.0
+STREAM_MAX_EDITS = 18
+
+# 正常结束的 finish_reason，其余 (SAFETY、RECITATION 等) 都视为回答被中途拦截
+_NORMAL_FINISH_REASONS = ("FINISH_REASON_UNSPECIFIED", "STOP", "MAX_TOKENS")
+
+def _log_prefetch_error(future):
+    # 预取的结果没人等，出错时要在这里记下来，否则异常会随 Future 一起被丢掉
+    error = future.exception()
+    if error is not None:
+        logger.error("Error prefetching token: %s", error)
+
+def process_feishu_message(session_id, message_id, user_text):
+    # token 只在回复时才用到，先在另一个线程里预取，和读历史、等 Gemini 首包并行进行
+    if not (_TOKEN_CACHE["token"] and time.time() < _TOKEN_CACHE["exp"]):
+        _executor.submit(get_feishu_tenant_token).add_done_callback(_log_prefetch_error)
+
+    # 拿到第一段文本就先回复，后面的内容通过编辑这条回复追加上去
+    text, shown = "", ""
+    reply_id, edits, last_edit = None, 0, 0.0
+    try:
+        chat = _gemini().start_chat(history=get_conversation_history(session_id))
+        stream_resp = chat.send_message(user_text, stream=True)
+
+        stop_reason = None
+        for chunk in stream_resp:
+            # 不直接用 chunk.text：没有 parts 的分片 (比如安全拦截时) 读 .text 会抛 ValueError
+            candidate = chunk.candidates[0] if chunk.candidates else None
+            if candidate is not None and candidate.finish_reason.name not in _NORMAL_FINISH_REASONS:
+                stop_reason = candidate.finish_reason.name
+            if candidate is None or not candidate.content.parts:
+                continue
+            text += "".join(part.text for part in candidate.content.parts)
+            if not text:
+                continue
+            if reply_id is None and not shown:
+                reply_id = reply_to_feishu(message_id, text)
+                shown, last_edit = text, time.time()
+            elif reply_id and edits < STREAM_MAX_EDITS and time.time() - last_edit >= STREAM_EDIT_INTERVAL:
+                edit_feishu_message(reply_id, text)
+                shown, last_edit, edits = text, time.time(), edits + 1
+        stream_resp.resolve()
+
+        if stop_reason:
+            # 被拦截的回答不写进历史 (SDK 也拼不出完整的历史)，在回复末尾说明原因
+            final = f"{text}\n\n⚠️ 回答被中断了 ({stop_reason})" if text else f"⚠️ Gemini 没有给出回答 ({stop_reason})"
+        elif text:
+            save_conversation_history(session_id, chat.history)
+            final = text
+        else:
+            # 没有文本的回合不写进历史，否则之后每次请求都会带上一条空的模型回复
+            final = "⚠️ Gemini 没有返回任何内容。"
+    except Exception as e:
+        # 已经开始流式回复的话，把错误补在那条回复后面，而不是再单独发一条
+        final = f"{text}\n\n机器人出错了: {e}" if reply_id else f"机器人出错了: {e}"
+
+    if reply_id is None:
+        # 首次回复失败 (或一直没有文本)，最后再整体回复一次
+        reply_id = reply_to_feishu(message_id, final)
+    elif final != shown:
+        edit_feishu_message(reply_id, final)
+    # 告诉调用方用户是否已经收到了回复
+    return reply_id is not None
 
-        if not user_text: return jsonify({"status": "empty message ignored"})
 
+# --- 各类请求的处理函数 ---
+
+# 飞书事件订阅的 URL 校验
+def _handle_challenge(data):
+    return Response(orjson.dumps({"challenge": data["challenge"]}), mimetype="application/json")
+
+# 群聊里 @机器人 时文本中会带上 @_user_1 这样的占位符，一次替换全部去掉
+_MENTION_RE = re.compile(r"@_user_\d+\s*")
+
+# 飞书 3 秒内收不到 200 就会重推同一个事件 (15 秒、5 分钟、1 小时、6 小时后各一次)，
+# 而回复是在请求内完成的，通常超过 3 秒，所以要按 event_id 去重。
+# 处理前先用短 TTL 占位，挡住处理期间到达的重推；回复送达后才把标记延长到 12 小时，
+# 没送达就删掉标记。函数被超时杀掉时占位会自己过期，后面的重推还能再处理一次
+_EVENT_CLAIM_TTL = 90
+_EVENT_DONE_TTL = 43200
+
+def _claim_event(event_id):
+    if not event_id:
+        return True
+    try:
+        return bool(_kv().set(f"feishu_event_{event_id}", "processing", nx=True, ex=_EVENT_CLAIM_TTL))
+    except Exception as e:
+        logger.error("Error claiming event: %s", e)
+        return True
+
+def _finish_event(event_id, delivered):
+    if not event_id:
+        return
+    try:
+        if delivered:
+            _kv().set(f"feishu_event_{event_id}", "done", ex=_EVENT_DONE_TTL)
+        else:
+            _kv().delete(f"feishu_event_{event_id}")
+    except Exception as e:
+        logger.error("Error finishing event: %s", e)
+
+# 1. 飞书聊天事件 (包含 header 和 event 结构)
+def _handle_feishu_message(data):
+    event = data.get("event", {})
+    message = event.get("message", {})
+    sender = event.get("sender", {})
+    message_id = message.get("message_id")
+    session_id = f"feishu_session_{message.get('chat_id')}_{sender.get('sender_id', {}).get('user_id')}"
+
+    try:
+        content_json = orjson.loads(message.get("content", "{}"))
+        text = content_json.get("text")
+        user_text = _MENTION_RE.sub("", text).strip() if isinstance(text, str) else ""
+    except (orjson.JSONDecodeError, AttributeError, TypeError):
+        user_text = ""
+
+    if not user_text: return jsonify({"status": "empty message ignored"})
+
+    event_id = data.get("header", {}).get("event_id")
+    if not _claim_event(event_id):
+        return jsonify({"status": "duplicate event ignored"})
+
+    delivered = False
+    try:
         if user_text.lower() == "/clear":
             clear_conversation_history(session_id)
-            reply_to_feishu(message_id, "✅ 历史对话已清除。")
+            delivered = reply_to_feishu(message_id, "✅ 历史对话已清除。") is not None
             return jsonify({"status": "command processed"})
 
-        try:
-            history = get_conversation_history(session_id)
-            chat = gemini_model.start_chat(history=history)
-            response = chat.send_message(user_text)
-            save_conversation_history(session_id, chat.history)
-            reply_to_feishu(message_id, response.text)
-        except Exception as e:
-            reply_to_feishu(message_id, f"机器人出错了: {e}")
-        
+        # 在请求内处理完再返回：流式回复已经让用户很快看到第一段内容
+        delivered = process_feishu_message(session_id, message_id, user_text)
         return jsonify({"status": "chat event processed"})
+    finally:
+        _finish_event(event_id, delivered)
 
-    # 2. 如果是来自多维表格的请求 (结构更简单，我们自己定义)
-    # 我们约定，多维表格会发送一个包含 "input_text" 字段的JSON
-    elif data and "input_text" in data:
-        print("Received a request from Bitable.")
-        input_text = data.get("input_text")
-        
-        if not input_text:
-            return jsonify({"error": "input_text is empty"}), 400
-        
-        try:
-            # 直接调用Gemini，不处理上下文历史
-            response = gemini_model.generate_content(input_text)
-            # 将结果直接返回给多维表格
-            return jsonify({"result": response.text})
-        except Exception as e:
-            print(f"Error processing Bitable request: {e}")
-            return jsonify({"error": str(e)}), 500
-            
-    # 如果是其他未知请求（比如浏览器直接访问）
+# 2. 来自多维表格的请求 (结构更简单，我们自己定义)
+# 我们约定，多维表格会发送一个包含 "input_text" 字段的JSON
+def _handle_bitable(data):
+    logger.debug("Received a request from Bitable.")
+    input_text = data.get("input_text")
+
+    if not input_text:
+        return jsonify({"error": "input_text is empty"}), 400
+
+    # 批量填充时经常有重复的输入，按输入内容的哈希把结果缓存一天，重复请求只需一次 KV 读取。
+    # 缓存只是锦上添花：KV 出错时记录日志，照常调用 Gemini 返回结果
+    cache_key = "gemini:" + hashlib.sha256(str(input_text).encode()).hexdigest()
+    try:
+        cached = _kv().get(cache_key)
+        if cached:
+            return jsonify({"result": cached})
+    except Exception as e:
+        logger.error("Error reading Bitable cache: %s", e)
+
+    try:
+        # 直接调用Gemini，不处理上下文历史
+        response = _gemini().generate_content(input_text)
+        result = response.text
+    except Exception as e:
+        logger.error("Error processing Bitable request: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+    try:
+        _kv().set(cache_key, result, ex=86400)
+    except Exception as e:
+        logger.error("Error writing Bitable cache: %s", e)
+    # 将结果直接返回给多维表格
+    return jsonify({"result": result})
+
+# 其他未知请求（比如浏览器直接访问）
+def _handle_unknown(data):
     return "Unsupported Media Type: This endpoint is for Feishu webhooks.", 415
 
+_HANDLERS = {
+    "feishu": _handle_feishu_message,
+    "bitable": _handle_bitable,
+    "challenge": _handle_challenge,
+    "unknown": _handle_unknown,
+}
+
+def _event_kind(data):
+    # 逻辑分流：判断是飞书聊天事件、多维表格的直接调用还是飞书的 URL 校验
+    if not isinstance(data, dict):
+        return "unknown"
+    if data.get("header", {}).get("event_type") == "im.message.receive_v1":
+        return "feishu"
+    if "input_text" in data:
+        return "bitable"
+    if "challenge" in data:
+        return "challenge"
+    return "unknown"
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST'])
+@app.route('/<path:path>', methods=['GET', 'POST'])
+def webhook_handler(path):
+    raw = request.get_data(cache=False)
+
+    # URL 校验请求最频繁也最简单，先在原始 body 里粗查一下，命中就直接回 challenge，不走后面的分流
+    # (聊天消息里的文本是转义过的 JSON 字符串，不会出现未转义的 "url_verification")
+    if b'"url_verification"' in raw:
+        try:
+            payload = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            payload = None
+        if isinstance(payload, dict) and "challenge" in payload:
+            return _handle_challenge(payload)
+
+    # 直接用 orjson 解析原始 body，绕开 Flask 的 json 模块；body 为空或不是 JSON 时按未知请求处理
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        data = None
+
+    return _HANDLERS[_event_kind(data)](data)
+
 
 if __name__ == "__main__":
     app.run(debug=True)